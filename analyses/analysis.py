@@ -1,10 +1,13 @@
 """A bunch of analysis scripts."""
 
-import glob
+import concurrent.futures
+import copy
+import functools
 import os
 import pickle
 import sys
-from typing import Any, Dict, Optional, Sequence, Tuple
+import tempfile
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 import os
 
 import haiku as hk
@@ -12,7 +15,6 @@ import ase
 import ase.build
 import optax
 import jax
-import jax.numpy as jnp
 import jraph
 import ml_collections
 import numpy as np
@@ -20,6 +22,7 @@ import pandas as pd
 import yaml
 from absl import logging
 from clu import checkpoint
+from flax import traverse_util
 from flax.training import train_state
 
 sys.path.append("..")
@@ -29,6 +32,11 @@ from symphony import models
 from symphony import train
 from configs import root_dirs
 
+try:
+    from yaml import CUnsafeLoader as _YAMLLoader
+except ImportError:
+    _YAMLLoader = yaml.UnsafeLoader
+
 try:
     from symphony.data import input_pipeline_tf
     import tensorflow as tf
@@ -38,21 +46,81 @@ except ImportError:
     logging.warning("TensorFlow not installed")
 
 
+def enable_persistent_compilation_cache(cache_dir: str) -> None:
+    """Persists compiled executables in cache_dir, so that repeated analyses do not recompile the models."""
+    jax.config.update("jax_compilation_cache_dir", os.path.expanduser(cache_dir))
+
+
+@functools.lru_cache(maxsize=4096)
+def _load_config_file_cached(config_path: str, config_stat: Tuple[int, int]) -> Any:
+    """Parses a config file. The modification time and size are part of the cache key, so edited files are re-parsed.
+
+    The parsed config is also pickled to a sidecar file next to the config,
+    together with the modification time and size of the config it was parsed from.
+    The sidecar is only used if these match the config exactly, so copies with preserved timestamps are not mistaken for fresh.
+    """
+    sidecar_path = config_path + ".pkl"
+    if os.path.exists(sidecar_path):
+        try:
+            with open(sidecar_path, "rb") as sidecar_file:
+                sidecar = pickle.load(sidecar_file)
+            if sidecar["config_stat"] == config_stat:
+                return sidecar["config"]
+        except Exception:
+            # The sidecar is only a cache, so fall back to parsing the config.
+            logging.warning("Ignoring unreadable config cache at %s", sidecar_path)
+
+    with open(config_path, "r") as config_file:
+        config = yaml.load(config_file, Loader=_YAMLLoader)
+
+    # Write to a temporary file first, so that concurrent readers never see a partial sidecar.
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            "wb", dir=os.path.dirname(sidecar_path), suffix=".tmp", delete=False
+        ) as tmp_file:
+            tmp_path = tmp_file.name
+            pickle.dump(
+                {"config_stat": config_stat, "config": config}, tmp_file, protocol=5
+            )
+        os.replace(tmp_path, sidecar_path)
+        tmp_path = None
+    except Exception:
+        logging.warning("Could not write config cache to %s", sidecar_path)
+    finally:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+    return config
+
+
+def load_config_file(config_path: str) -> Any:
+    """Loads a saved config.yml, using the libyaml C parser if available.
+
+    Configs are saved as ConfigDict objects by train.py, so Python tags must be supported.
+    Each file is parsed at most once per process (unless modified); callers get their own copy.
+    Note that this writes a config.yml.pkl cache file next to each config it loads, if the directory is writable.
+    """
+    config_stat = os.stat(config_path)
+    return copy.deepcopy(
+        _load_config_file_cached(
+            config_path, (config_stat.st_mtime_ns, config_stat.st_size)
+        )
+    )
+
+
 def cast_keys_as_int(dictionary: Dict[Any, Any]) -> Dict[Any, Any]:
     """Returns a dictionary with string keys converted to integers, wherever possible."""
     casted_dictionary = {}
     for key, val in dictionary.items():
-        try:
+        if isinstance(val, dict):
             val = cast_keys_as_int(val)
-        except AttributeError:
-            pass
 
-        try:
+        if isinstance(key, str) and key.removeprefix("-").isdecimal():
             key = int(key)
-        except ValueError:
-            pass
-        finally:
-            casted_dictionary[key] = val
+        casted_dictionary[key] = val
     return casted_dictionary
 
 
@@ -64,8 +132,8 @@ def name_from_workdir(workdir: str) -> str:
     return workdir[index:]
 
 
-def config_to_dataframe(config: ml_collections.ConfigDict) -> Dict[str, Any]:
-    """Flattens a nested config into a Pandas dataframe."""
+def flatten_config(config: ml_collections.ConfigDict) -> Dict[str, Any]:
+    """Flattens a nested config into a single dict, with keys prefixed by 'config.'."""
 
     # Compatibility with old configs.
     if "num_interactions" not in config:
@@ -77,16 +145,15 @@ def config_to_dataframe(config: ml_collections.ConfigDict) -> Dict[str, Any]:
         assert config.num_channels == config.n_filters
         del config.n_atom_basis, config.n_filters
 
-    def iterate_with_prefix(dictionary: Dict[str, Any], prefix: str):
-        """Iterates through a nested dictionary, yielding the flattened and prefixed keys and values."""
-        for k, v in dictionary.items():
-            if isinstance(v, dict):
-                yield from iterate_with_prefix(v, prefix=f"{prefix}{k}.")
-            else:
-                yield prefix + k, v
+    return {
+        f"config.{key}": val
+        for key, val in traverse_util.flatten_dict(config.to_dict(), sep=".").items()
+    }
 
-    config_dict = dict(iterate_with_prefix(config.to_dict(), "config."))
-    return pd.DataFrame().from_dict([config_dict])
+
+def config_to_dataframe(config: ml_collections.ConfigDict) -> pd.DataFrame:
+    """Flattens a nested config into a Pandas dataframe."""
+    return pd.DataFrame([flatten_config(config)])
 
 
 def load_model_at_step(
@@ -100,8 +167,7 @@ def load_model_at_step(
     with open(params_file, "rb") as f:
         params = pickle.load(f)
 
-    with open(workdir + "/config.yml", "rt") as config_file:
-        config = yaml.unsafe_load(config_file)
+    config = load_config_file(os.path.join(workdir, "config.yml"))
     assert config is not None
     config = ml_collections.ConfigDict(config)
     config.root_dir = root_dirs.get_root_dir(
@@ -109,7 +175,7 @@ def load_model_at_step(
     )
 
     model = models.create_model(config, run_in_evaluation_mode=run_in_evaluation_mode)
-    params = jax.tree_util.tree_map(jnp.asarray, params)
+    params = jax.device_put(params)
     return model, params, config
 
 
@@ -128,8 +194,7 @@ def load_weighted_average_model_at_steps(
             params_avg = jax.tree_util.tree_map(lambda x, y: x + y, params_avg, params)
     params_avg = jax.tree_util.tree_map(lambda x: x / len(steps), params_avg)
 
-    with open(workdir + "/config.yml", "rt") as config_file:
-        config = yaml.unsafe_load(config_file)
+    config = load_config_file(os.path.join(workdir, "config.yml"))
     assert config is not None
     config = ml_collections.ConfigDict(config)
     if 'max_targets_per_graph' in config:
@@ -142,52 +207,105 @@ def load_weighted_average_model_at_steps(
         )
 
     model = models.create_model(config, run_in_evaluation_mode=run_in_evaluation_mode)
-    params_avg = jax.tree_util.tree_map(jnp.asarray, params_avg)
+    params_avg = jax.device_put(params_avg)
     return model, params_avg, config
 
 
 
-def get_results_as_dataframe(basedir: str) -> pd.DataFrame:
-    """Returns the results for the given model as a pandas dataframe."""
+def find_workdirs(basedir: str) -> List[str]:
+    """Returns all directories under basedir containing a saved config, in a single pass.
 
-    results = pd.DataFrame()
-    for config_file_path in glob.glob(
-        os.path.join(basedir, "**", "*.yml"), recursive=True
-    ):
-        workdir = os.path.dirname(config_file_path)
-        try:
-            config, best_state, _, metrics_for_best_state = load_from_workdir(workdir)
-        except FileNotFoundError:
-            logging.warning(f"Skipping {workdir} because it is incomplete.")
-            continue
+    Symlinked directories are followed, so that runs linked into basedir are found.
+    """
+    workdirs = []
+    for dirpath, _, filenames in os.walk(basedir, followlinks=True):
+        if "config.yml" in filenames:
+            workdirs.append(dirpath)
+    return sorted(workdirs)
 
-        num_params = sum(
-            jax.tree_util.tree_leaves(jax.tree_util.tree_map(jnp.size, best_state.params))
-        )
-        config_df = config_to_dataframe(config)
-        other_df = pd.DataFrame.from_dict(
-            {
-                "model": [config.model.lower()],
-                "max_l": [config.max_ell],
-                "num_interactions": [config.num_interactions],
-                "num_channels": [config.num_channels],
-                "num_params": [num_params],
-                # "num_train_molecules": [
+
+def _try_load_results_from_workdir(
+    workdir: str,
+) -> Optional[Tuple[ml_collections.ConfigDict, int, Dict[Any, Any]]]:
+    """Returns the config, number of parameters and best metrics of a workdir, or None if the workdir is incomplete.
+
+    Only these are returned, so that the training state is freed as soon as this workdir is done.
+    """
+    try:
+        config, best_state, _, metrics_for_best_state = load_from_workdir(workdir)
+    except FileNotFoundError:
+        logging.warning(f"Skipping {workdir} because it is incomplete.")
+        return None
+
+    # The sizes only depend on the shapes, so there is no need to call into JAX.
+    num_params = sum(
+        int(np.prod(leaf.shape, dtype=np.int64))
+        for leaf in jax.tree_util.tree_leaves(best_state.params)
+    )
+    return config, num_params, metrics_for_best_state
+
+
+def get_results_as_dataframe(
+    basedir: str, num_workers: Optional[int] = None
+) -> pd.DataFrame:
+    """Returns the results for the given model as a pandas dataframe.
+
+    Workdirs are loaded concurrently by num_workers threads (by default, based on the number of CPUs),
+    since loading is mostly I/O. The dataframe itself is assembled on the calling thread,
+    in a deterministic order, while the remaining workdirs are still loading.
+    """
+
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for loaded in executor.map(
+            _try_load_results_from_workdir, find_workdirs(basedir)
+        ):
+            if loaded is None:
+                continue
+            config, num_params, metrics_for_best_state = loaded
+
+            row = {
+                **flatten_config(config),
+                "model": config.model.lower(),
+                "max_l": config.max_ell,
+                "num_interactions": config.num_interactions,
+                "num_channels": config.num_channels,
+                "num_params": num_params,
+                # "num_train_molecules": (
                 #     config.train_molecules[1] - config.train_molecules[0]
-                # ],
+                # ),
             }
-        )
-        df = pd.merge(config_df, other_df, left_index=True, right_index=True)
-        for split in metrics_for_best_state:
-            metrics_for_split = {
-                f"{split}.{metric}": [metrics_for_best_state[split][metric].item()]
-                for metric in metrics_for_best_state[split]
-            }
-            metrics_df = pd.DataFrame.from_dict(metrics_for_split)
-            df = pd.merge(df, metrics_df, left_index=True, right_index=True)
-        results = pd.concat([results, df], ignore_index=True)
+            for split, metrics_for_split in metrics_for_best_state.items():
+                for metric, value in metrics_for_split.items():
+                    row[f"{split}.{metric}"] = value.item()
+            results.append(row)
+
+    return pd.DataFrame(results)
 
-    return results
+
+def split_results_by_split(results: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Splits the output of get_results_as_dataframe into one dataframe per split.
+
+    Each dataframe has the config and model columns, and the metrics for that split named by metric only.
+    """
+    shared_columns = [
+        column
+        for column in results.columns
+        if column.startswith("config.") or "." not in column
+    ]
+    metric_columns_by_split = {}
+    for column in results.columns:
+        if column.startswith("config.") or "." not in column:
+            continue
+        split, metric = column.split(".", 1)
+        metric_columns_by_split.setdefault(split, {})[column] = metric
+
+    return {
+        split: results[shared_columns + list(metric_columns)]
+        .rename(columns=metric_columns)
+        .dropna(subset=list(metric_columns.values()), how="all")
+        for split, metric_columns in metric_columns_by_split.items()
+    }
 
 
 def load_metrics_from_workdir(
@@ -209,8 +327,7 @@ def load_metrics_from_workdir(
         raise FileNotFoundError(f"No saved config found at {workdir}")
 
     logging.info("Saved config found at %s", saved_config_path)
-    with open(saved_config_path, "r") as config_file:
-        config = yaml.unsafe_load(config_file)
+    config = load_config_file(saved_config_path)
 
     # Check that the config was loaded correctly.
     assert config is not None
@@ -247,8 +364,7 @@ def load_from_workdir(
         raise FileNotFoundError(f"No saved config found at {workdir}")
 
     logging.info("Saved config found at %s", saved_config_path)
-    with open(saved_config_path, "r") as config_file:
-        config = yaml.unsafe_load(config_file)
+    config = load_config_file(saved_config_path)
 
     # Check that the config was loaded correctly.
     assert config is not None
@@ -291,7 +407,7 @@ def load_from_workdir(
         )
 
         with open(pickled_params_file, "rb") as f:
-            params = jax.tree_util.tree_map(np.array, pickle.load(f))
+            params = pickle.load(f)
     else:
         if init_graphs is None:
             logging.info("Initializing dummy model with init_graphs from dataloader")
@@ -312,7 +428,7 @@ def load_from_workdir(
     checkpoint_dir = os.path.join(workdir, "checkpoints")
     ckpt = checkpoint.Checkpoint(checkpoint_dir, max_to_keep=5)
     data = ckpt.restore({"best_state": dummy_state, "metrics_for_best_state": None})
-    best_state = jax.tree_util.tree_map(jnp.asarray, data["best_state"])
+    best_state = jax.device_put(data["best_state"])
     best_state_in_eval_mode = best_state.replace(apply_fn=eval_net.apply)
 
     return (
@@ -323,6 +439,12 @@ def load_from_workdir(
     )
 
 
+@functools.lru_cache(maxsize=1)
+def _load_qm9_dataset() -> Sequence[ase.Atoms]:
+    """Loads the QM9 dataset once, and reuses it across calls."""
+    return qm9.load_qm9("qm9_data")
+
+
 def construct_molecule(molecule_str: str) -> Tuple[ase.Atoms, str]:
     """Returns a molecule from the given input string.
 
@@ -337,8 +459,9 @@ def construct_molecule(molecule_str: str) -> Tuple[ase.Atoms, str]:
 
     # A number is interpreted as a QM9 molecule index.
     if molecule_str.isdigit():
-        dataset = qm9.load_qm9("qm9_data")
-        molecule = dataset[int(molecule_str)]
+        dataset = _load_qm9_dataset()
+        # Copy, so that callers cannot modify the cached dataset.
+        molecule = dataset[int(molecule_str)].copy()
         return molecule, f"qm9_index={molecule_str}"
 
     # If the string is a valid molecule name, try to build it.
@@ -13,6 +13,7 @@ import chex
 import jax
 import jax.numpy as jnp
 import jraph
+import numpy as np
 import optax
 import tqdm
 from absl import app, flags, logging
@@ -262,19 +263,22 @@ def generate_molecules(
     else:
         final_padded_fragments, stops = chunk_and_apply(params, rngs)
 
+    # Map species to atomic numbers on the host, rather than with a JAX gather.
+    atomic_numbers_lut = np.asarray(models.ATOMIC_NUMBERS)
+
     molecule_list = []
     for seed in tqdm.tqdm(seeds, desc="Visualizing molecules"):
-        final_padded_fragments_for_seed = jax.tree_util.tree_map(
-            lambda x: x[seed], final_padded_fragments
+        # Fetch this seed's outputs once, and keep them as NumPy arrays from here on.
+        final_padded_fragments_for_seed, stops_for_seed = jax.device_get(
+            jax.tree_util.tree_map(lambda x: x[seed], (final_padded_fragments, stops))
         )
-        stops_for_seed = jax.tree_util.tree_map(lambda x: x[seed], stops)
 
         for index, final_padded_fragment in enumerate(
-            jraph.unbatch(jraph.unpad_with_graphs(final_padded_fragments_for_seed))
+            jraph.unbatch_np(jraph.unpad_with_graphs(final_padded_fragments_for_seed))
         ):
             generated_molecule = ase.Atoms(
                 positions=final_padded_fragment.nodes.positions,
-                numbers=models.get_atomic_numbers(final_padded_fragment.nodes.species),
+                numbers=atomic_numbers_lut[final_padded_fragment.nodes.species],
             )
 
             if stops_for_seed[index]:
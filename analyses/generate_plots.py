@@ -389,9 +389,14 @@ def main(argv):
     if len(argv) > 1:
         raise app.UsageError("Too many command-line arguments.")
 
+    if FLAGS.compilation_cache_dir is not None:
+        analysis.enable_persistent_compilation_cache(FLAGS.compilation_cache_dir)
+
     # Get results.
     basedir = os.path.abspath(FLAGS.basedir)
-    results = analysis.get_results_as_dataframe(ALL_MODELS, ALL_METRICS, basedir)
+    results = analysis.split_results_by_split(
+        analysis.get_results_as_dataframe(basedir)
+    )
     logging.info(results)
 
     # Make plots.
@@ -418,6 +423,11 @@ if __name__ == "__main__":
         os.path.join(os.getcwd(), "analyses"),
         "Directory where plots should be saved.",
     )
+    flags.DEFINE_string(
+        "compilation_cache_dir",
+        None,
+        "If set, compiled models are cached in this directory across runs.",
+    )
 
     flags.mark_flags_as_required(["basedir"])
     app.run(main)
@@ -569,10 +569,8 @@ if __name__ == "__main__":
     # store gathered statistics in metrics dataframe
     stats_df = pd.DataFrame(stats, columns=np.array(stat_heads))
     stats_df.insert(0, "formula", formulas)
-    metric_df_dict = analysis.get_results_as_dataframe(
-        [""],
-        ["total_loss", "atom_type_loss", "position_loss"],
-        args.model_path,
+    metric_df_dict = analysis.split_results_by_split(
+        analysis.get_results_as_dataframe(args.model_path)
     )
     cum_stats = {
         "valid_mol": stats_df["valid_mol"].sum() / len(stats_df),
@@ -1,7 +1,9 @@
 """Relaxes structures using Universal Force Fields from RDKit."""
 
-from typing import Optional, Tuple, Sequence
+from typing import Callable, Optional, Tuple, Sequence
 
+import concurrent.futures
+import functools
 import os
 import glob
 
@@ -15,74 +17,149 @@ from absl import logging
 FLAGS = flags.FLAGS
 
 
-def add_bonds_to_molecules(molecules_dir: str, output_dir: str) -> None:
-    """Adds bonds to all molecules in a directory."""
+def _get_chunksize(num_files: int, max_workers: int) -> int:
+    """Returns a chunksize that amortizes the inter-process communication overhead."""
+    return max(1, num_files // (4 * max_workers))
+
+
+def _map_over_files(
+    fn: Callable[[str], None], files: Sequence[str], max_workers: Optional[int]
+) -> None:
+    """Applies fn to each file in parallel, across a pool of processes."""
+    if not files:
+        return
+
+    max_workers = max_workers or os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Consume the iterator, so that any exceptions are raised here.
+        list(
+            executor.map(fn, files, chunksize=_get_chunksize(len(files), max_workers))
+        )
 
-    for molecules_file in os.listdir(molecules_dir):
-        if not molecules_file.endswith(".xyz"):
-            continue
 
-        mol = Chem.MolFromXYZFile(os.path.join(molecules_dir, molecules_file))
-        mol = Chem.Mol(mol)
-        valid_charge = False
-        for charge in [0, -1, 1, -2, 2]:
-            try:
-                rdDetermineBonds.DetermineBonds(mol, charge=charge)
-                valid_charge = True
-                break
-            except ValueError:
-                continue
-
-        if not valid_charge:
-            logging.info("Could not find valid charge for %s", molecules_file)
+def _add_bonds_to_molecule(
+    molecules_file: str, molecules_dir: str, output_dir: str
+) -> None:
+    """Adds bonds to a single molecule, and saves it as an SDF file."""
+    mol = Chem.MolFromXYZFile(os.path.join(molecules_dir, molecules_file))
+    mol = Chem.Mol(mol)
+
+    # Bonds can only be assigned when all electrons are paired,
+    # so skip the charges which leave an odd number of electrons.
+    num_electrons = sum(atom.GetAtomicNum() for atom in mol.GetAtoms())
+    candidate_charges = [
+        charge for charge in [0, -1, 1, -2, 2] if (num_electrons - charge) % 2 == 0
+    ]
+
+    valid_charge = False
+    for charge in candidate_charges:
+        try:
+            rdDetermineBonds.DetermineBonds(mol, charge=charge)
+            valid_charge = True
+            break
+        except ValueError:
             continue
 
-        for bond in mol.GetBonds():
-            if bond.GetBondType() == Chem.BondType.DOUBLE:
-                bond.SetStereo(Chem.BondStereo.STEREONONE)
-            elif bond.GetBondType() == Chem.BondType.SINGLE:
-                bond.SetBondDir(Chem.BondDir.NONE)
+    if not valid_charge:
+        logging.info("Could not find valid charge for %s", molecules_file)
+        return
 
-        # Save the bonded molecules.
-        output_molecules_file = molecules_file.replace(".xyz", ".sdf")
-        writer = Chem.SDWriter(os.path.join(output_dir, output_molecules_file))
-        writer.write(mol, confId=0)
+    for bond in mol.GetBonds():
+        if bond.GetBondType() == Chem.BondType.DOUBLE:
+            bond.SetStereo(Chem.BondStereo.STEREONONE)
+        elif bond.GetBondType() == Chem.BondType.SINGLE:
+            bond.SetBondDir(Chem.BondDir.NONE)
 
+    # Save the bonded molecules.
+    output_molecules_file = molecules_file.replace(".xyz", ".sdf")
+    writer = Chem.SDWriter(os.path.join(output_dir, output_molecules_file))
+    writer.write(mol, confId=0)
+    writer.close()
 
-def relax_structures_of_molecules(
-    molecules_dir: str, output_dir: str, unbonded_output_dir: str
+
+def add_bonds_to_molecules(
+    molecules_dir: str, output_dir: str, max_workers: Optional[int] = None
 ) -> None:
-    """Relaxes the structures of all molecules in a directory."""
+    """Adds bonds to all molecules in a directory, in parallel across files."""
+    # Skip molecules which have already been processed.
+    molecules_files = [
+        molecules_file
+        for molecules_file in os.listdir(molecules_dir)
+        if molecules_file.endswith(".xyz")
+        and not os.path.exists(
+            os.path.join(output_dir, molecules_file.replace(".xyz", ".sdf"))
+        )
+    ]
+    _map_over_files(
+        functools.partial(
+            _add_bonds_to_molecule, molecules_dir=molecules_dir, output_dir=output_dir
+        ),
+        molecules_files,
+        max_workers,
+    )
 
-    for molecules_file in os.listdir(molecules_dir):
-        if not molecules_file.endswith(".sdf"):
-            continue
 
-        mol = Chem.SDMolSupplier(
-            os.path.join(molecules_dir, molecules_file), removeHs=False
-        )[0]
-        energy_value_initial = AllChem.UFFGetMoleculeForceField(mol).CalcEnergy()
+def _relax_structure_of_molecule(
+    molecules_file: str, molecules_dir: str, output_dir: str, unbonded_output_dir: str
+) -> None:
+    """Relaxes the structure of a single molecule, and saves it."""
+    mol = Chem.SDMolSupplier(
+        os.path.join(molecules_dir, molecules_file), removeHs=False
+    )[0]
+    energy_value_initial = AllChem.UFFGetMoleculeForceField(mol).CalcEnergy()
+
+    AllChem.UFFOptimizeMolecule(mol, maxIters=100000, ignoreInterfragInteractions=False)
+
+    energy_value_final = AllChem.UFFGetMoleculeForceField(mol).CalcEnergy()
+    logging.info(
+        "Energy change for %s: %f",
+        molecules_file,
+        energy_value_final - energy_value_initial,
+    )
 
-        AllChem.UFFOptimizeMolecule(
-            mol, maxIters=100000, ignoreInterfragInteractions=False
-        )
+    # Save the relaxed and bonded molecules.
+    writer = Chem.SDWriter(os.path.join(output_dir, molecules_file))
+    writer.write(mol, confId=0)
+    writer.close()
 
-        energy_value_final = AllChem.UFFGetMoleculeForceField(mol).CalcEnergy()
-        logging.info(
-            "Energy change for %s: %f",
-            molecules_file,
-            energy_value_final - energy_value_initial,
-        )
+    # Also, save the relaxed molecule without bonds.
+    Chem.MolToXYZFile(
+        mol,
+        os.path.join(unbonded_output_dir, molecules_file.replace(".sdf", ".xyz")),
+    )
 
-        # Save the relaxed and bonded molecules.
-        writer = Chem.SDWriter(os.path.join(output_dir, molecules_file))
-        writer.write(mol, confId=0)
 
-        # Also, save the relaxed molecule without bonds.
-        Chem.MolToXYZFile(
-            mol,
-            os.path.join(unbonded_output_dir, molecules_file.replace(".sdf", ".xyz")),
+def relax_structures_of_molecules(
+    molecules_dir: str,
+    output_dir: str,
+    unbonded_output_dir: str,
+    max_workers: Optional[int] = None,
+) -> None:
+    """Relaxes the structures of all molecules in a directory, in parallel."""
+    # Only relax molecules with missing outputs.
+    molecules_files = [
+        molecules_file
+        for molecules_file in os.listdir(molecules_dir)
+        if molecules_file.endswith(".sdf")
+        and not (
+            os.path.exists(os.path.join(output_dir, molecules_file))
+            and os.path.exists(
+                os.path.join(
+                    unbonded_output_dir, molecules_file.replace(".sdf", ".xyz")
+                )
+            )
         )
+    ]
+    _map_over_files(
+        functools.partial(
+            _relax_structure_of_molecule,
+            molecules_dir=molecules_dir,
+            output_dir=output_dir,
+            unbonded_output_dir=unbonded_output_dir,
+        ),
+        molecules_files,
+        max_workers,
+    )
 
 
 def process_molecules_dir(molecules_dir: str, relax_structures: bool) -> None:
@@ -1,7 +1,10 @@
 from typing import Optional, Sequence
+import functools
 import plotly.graph_objects as go
 import plotly.subplots
 import numpy as np
+import jax
+import jax.numpy as jnp
 import e3nn_jax as e3nn
 import ase
 import rdkit
@@ -36,7 +39,107 @@ with importlib.resources.open_text("analyses", 'elements.ini') as f:  # taken fr
         ATOMIC_COLORS[z] = f"rgb({255 * r}, {255 * g}, {255 * b})"
         ATOMIC_SIZES[z] = float(radius) * 20
 
+# Dense lookup tables indexed directly by atomic number.
+ATOMIC_SIZES_LUT = np.zeros(max(ATOMIC_NUMBERS) + 1)
+ATOMIC_COLORS_LUT = np.full(max(ATOMIC_NUMBERS) + 1, "", dtype=object)
+for z in ATOMIC_NUMBERS:
+    ATOMIC_SIZES_LUT[z] = ATOMIC_SIZES[z]
+    ATOMIC_COLORS_LUT[z] = ATOMIC_COLORS[z]
+
+
+@functools.partial(jax.jit, static_argnames=("res_beta", "res_alpha"))
+def _position_probs_from_coeffs(
+    position_coeffs: e3nn.IrrepsArray, res_beta: int, res_alpha: int
+) -> e3nn.SphericalSignal:
+    """Returns the unnormalized position probabilities on a grid, compiled once per grid size."""
+    num_radii = position_coeffs.shape[1]
+    position_logits = models.log_coeffs_to_logits(
+        position_coeffs, res_beta, res_alpha, num_radii
+    )
+    position_logits.grid_values -= jnp.max(position_logits.grid_values)
+    return position_logits.apply(jnp.exp)
+
+
+@functools.partial(jax.jit, static_argnames=("res_beta", "res_alpha"))
+def _coeffs_to_signal(
+    coeffs: e3nn.IrrepsArray, res_beta: int, res_alpha: int
+) -> e3nn.SphericalSignal:
+    """Returns the signal on a grid for the given coefficients, compiled once per grid size."""
+    return e3nn.to_s2grid(
+        coeffs, res_beta, res_alpha, quadrature="soft", p_val=1, p_arg=-1
+    )
+
+
+def _get_unit_sphere_for_plotting(signal: e3nn.SphericalSignal) -> np.ndarray:
+    """Returns the points on the unit sphere used to plot the signal, of shape [res_beta + 2, res_alpha + 1, 3].
+
+    This matches e3nn.SphericalSignal.pad_to_plot(), but is computed with NumPy on the host.
+    """
+    y = np.concatenate([[-1.0], np.asarray(signal.grid_y), [1.0]])
+    alpha = np.asarray(signal.grid_alpha)
+    alpha = np.concatenate([alpha, alpha[:1]])
+    sin_beta = np.sqrt(1.0 - y**2)[:, None]
+    return np.stack(
+        [
+            sin_beta * np.sin(alpha),
+            y[:, None] * np.ones_like(alpha),
+            sin_beta * np.cos(alpha),
+        ],
+        axis=-1,
+    )
+
 
+def _pad_grid_values_for_plotting(grid_values: np.ndarray) -> np.ndarray:
+    """Pads grid values of shape [..., res_beta, res_alpha] to [..., res_beta + 2, res_alpha + 1].
+
+    The poles are set to the mean of the nearest ring, and the first alpha column is repeated at the end,
+    as in e3nn.SphericalSignal.pad_to_plot().
+    """
+    res_alpha = grid_values.shape[-1]
+    north_pole = grid_values[..., :1, :].mean(axis=-1, keepdims=True)
+    south_pole = grid_values[..., -1:, :].mean(axis=-1, keepdims=True)
+    padded = np.concatenate(
+        [
+            np.repeat(north_pole, res_alpha, axis=-1),
+            grid_values,
+            np.repeat(south_pole, res_alpha, axis=-1),
+        ],
+        axis=-2,
+    )
+    return np.concatenate([padded, padded[..., :1]], axis=-1)
+
+
+# Layout settings shared by all figures. These are never modified in place.
+_AXIS = dict(
+    showbackground=False,
+    showticklabels=False,
+    showgrid=False,
+    zeroline=False,
+    title="",
+    nticks=3,
+)
+_SCENE = dict(
+    xaxis=_AXIS,
+    yaxis=_AXIS,
+    zaxis=_AXIS,
+    aspectmode="data",
+)
+_LEGEND = dict(
+    yanchor="top",
+    y=0.99,
+    xanchor="right",
+    x=0.1,
+)
+_BACKGROUND_COLOR = "rgba(255,255,255,1)"
+_FRAGMENT_ATOMS_TRACE_NAME = "Molecule Atoms"
+
+
+def _get_atomic_numbers(fragment: datatypes.Fragments) -> np.ndarray:
+    """Returns the atomic numbers of the atoms in the fragment, computed on the host."""
+    return np.asarray(models.ATOMIC_NUMBERS)[np.asarray(fragment.nodes.species)]
+
+
+@functools.lru_cache(maxsize=None)
 def get_title_for_name(name: str) -> str:
     """Returns the title for the given name."""
     if "e3schnet" in name:
@@ -60,24 +163,23 @@ def combine_visualizations(
 
     # Save the original visibility of the traces.
     original_visibility = {i: trace.visible for i, trace in enumerate(all_traces)}
+    original_visibility_array = np.array(
+        [original_visibility[i] for i in range(len(all_traces))], dtype=object
+    )
 
     steps = []
     ct = 0
     start_indices = [0]
     for fig in figs:
+        # Only the traces of this figure keep their original visibility.
+        visible = np.full(len(all_traces), False, dtype=object)
+        visible[ct : ct + len(fig.data)] = original_visibility_array[
+            ct : ct + len(fig.data)
+        ]
         steps.append(
             dict(
                 method="restyle",
-                args=[
-                    {
-                        "visible": [
-                            original_visibility[i]
-                            if ct <= i < ct + len(fig.data)
-                            else False
-                            for i, trace in enumerate(all_traces)
-                        ]
-                    }
-                ],
+                args=[{"visible": visible.tolist()}],
             )
         )
         ct += len(fig.data)
@@ -88,33 +190,15 @@ def combine_visualizations(
     if labels is None:
         labels = steps
 
-    axis = dict(
-        showbackground=False,
-        showticklabels=False,
-        showgrid=False,
-        zeroline=False,
-        title="",
-        nticks=3,
-    )
     layout = dict(
         sliders=[{label_name: labels}],
         title_x=0.5,
         width=1500,
         height=800,
-        scene=dict(
-            xaxis=dict(**axis),
-            yaxis=dict(**axis),
-            zaxis=dict(**axis),
-            aspectmode="data",
-        ),
-        paper_bgcolor="rgba(255,255,255,1)",
-        plot_bgcolor="rgba(255,255,255,1)",
-        legend=dict(
-            yanchor="top",
-            y=0.99,
-            xanchor="right",
-            x=0.1,
-        ),
+        scene=_SCENE,
+        paper_bgcolor=_BACKGROUND_COLOR,
+        plot_bgcolor=_BACKGROUND_COLOR,
+        legend=_LEGEND,
     )
 
     fig_all = plotly.subplots.make_subplots(
@@ -145,9 +229,7 @@ def get_plotly_traces_for_fragment(
     fragment: datatypes.Fragments,
 ) -> Sequence[go.Scatter3d]:
     """Returns the plotly traces for the fragment."""
-    atomic_numbers = list(
-        int(num) for num in models.get_atomic_numbers(fragment.nodes.species)
-    )
+    atomic_numbers = _get_atomic_numbers(fragment)
     molecule_traces = []
     molecule_traces.append(
         go.Scatter3d(
@@ -156,14 +238,14 @@ def get_plotly_traces_for_fragment(
             z=fragment.nodes.positions[:, 2],
             mode="markers",
             marker=dict(
-                size=[ATOMIC_SIZES[num] for num in atomic_numbers],
-                color=[ATOMIC_COLORS[num] for num in atomic_numbers],
+                size=ATOMIC_SIZES_LUT[atomic_numbers].tolist(),
+                color=ATOMIC_COLORS_LUT[atomic_numbers].tolist(),
             ),
             hovertext=[
                 f"Element: {ase.data.chemical_symbols[num]}" for num in atomic_numbers
             ],
             opacity=1.0,
-            name="Molecule Atoms",
+            name=_FRAGMENT_ATOMS_TRACE_NAME,
             legendrank=1,
         )
     )
@@ -217,21 +299,42 @@ def get_plotly_traces_for_predictions(
 ) -> Sequence[go.Scatter3d]:
     """Returns a list of plotly traces for the prediction."""
 
-    atomic_numbers = list(
-        int(num) for num in models.get_atomic_numbers(fragment.nodes.species)
+    atomic_numbers = _get_atomic_numbers(fragment)
+
+    # Transfer everything we need from the device at once.
+    (
+        focus,
+        stop,
+        stop_probability,
+        predicted_target_species,
+        position_vectors,
+        focus_and_target_species_probs,
+        radii,
+    ) = jax.device_get(
+        (
+            pred.globals.focus_indices,
+            pred.globals.stop,
+            pred.globals.stop_probs,
+            pred.globals.target_species,
+            pred.globals.position_vectors,
+            pred.nodes.focus_and_target_species_probs,
+            pred.globals.radial_bins,
+        )
     )
-    focus = pred.globals.focus_indices.item()
+    focus = focus.item()
+    stop = stop.item()
+    stop_probability = stop_probability.item()
+    predicted_target_species = predicted_target_species.item()
     focus_position = fragment.nodes.positions[focus]
-    focus_and_target_species_probs = pred.nodes.focus_and_target_species_probs
     focus_probs = focus_and_target_species_probs.sum(axis=-1)
     num_nodes, num_elements = focus_and_target_species_probs.shape
 
     # Highlight the focus probabilities, obtained by marginalization over all elements.
-    def get_scaling_factor(focus_prob: float, num_nodes: int) -> float:
-        """Returns a scaling factor for the size of the atom."""
-        if focus_prob < 1 / num_nodes - 1e-3:
-            return 0.95
-        return 1 + focus_prob**2
+    # Atoms with below-uniform focus probability are shrunk slightly.
+    scaling_factors = np.where(
+        focus_probs < 1 / num_nodes - 1e-3, 0.95, 1 + focus_probs**2
+    )
+    focus_sizes = scaling_factors * ATOMIC_SIZES_LUT[atomic_numbers]
 
     def chosen_focus_string(index: int, focus: int) -> str:
         """Returns a string indicating whether the atom was chosen as the focus."""
@@ -239,6 +342,7 @@ def get_plotly_traces_for_predictions(
             return f"Atom {index} (Chosen as Focus)"
         return f"Atom {index} (Not Chosen as Focus)"
 
+    # The atoms of the fragment are drawn once, with sizes scaled by the focus probabilities.
     molecule_traces = []
     molecule_traces.append(
         go.Scatter3d(
@@ -247,23 +351,21 @@ def get_plotly_traces_for_predictions(
             z=fragment.nodes.positions[:, 2],
             mode="markers",
             marker=dict(
-                size=[
-                    get_scaling_factor(float(focus_prob), num_nodes) * ATOMIC_SIZES[num]
-                    for focus_prob, num in zip(focus_probs, atomic_numbers)
-                ],
-                color=["rgba(150, 75, 0, 0.5)" for _ in range(num_nodes)],
+                size=focus_sizes.tolist(),
+                color=ATOMIC_COLORS_LUT[atomic_numbers].tolist(),
             ),
             hovertext=[
+                f"Element: {ase.data.chemical_symbols[num]}<br>"
                 f"Focus Probability: {focus_prob:.3f}<br>{chosen_focus_string(i, focus)}"
-                for i, focus_prob in enumerate(focus_probs)
+                for i, (num, focus_prob) in enumerate(zip(atomic_numbers, focus_probs))
             ],
             name="Focus Probabilities",
         )
     )
 
     # Highlight predicted position, if not stopped.
-    if not pred.globals.stop:
-        predicted_target_position = focus_position + pred.globals.position_vectors
+    if not stop:
+        predicted_target_position = focus_position + position_vectors
         molecule_traces.append(
             go.Scatter3d(
                 x=[predicted_target_position[0]],
@@ -274,7 +376,7 @@ def get_plotly_traces_for_predictions(
                     size=[
                         1.05
                         * ATOMIC_SIZES[
-                            models.ATOMIC_NUMBERS[pred.globals.target_species.item()]
+                            models.ATOMIC_NUMBERS[predicted_target_species]
                         ]
                     ],
                     color=["purple"],
@@ -286,25 +388,33 @@ def get_plotly_traces_for_predictions(
 
     # Since we downsample the position grid, we need to recompute the position probabilities.
     position_coeffs = pred.globals.log_position_coeffs
-    radii = pred.globals.radial_bins
-    num_radii = radii.shape[0]
-    position_logits = models.log_coeffs_to_logits(position_coeffs, 50, 99, num_radii)
-    position_logits.grid_values -= np.max(position_logits.grid_values)
-    position_probs = position_logits.apply(np.exp)
+    position_probs = _position_probs_from_coeffs(
+        position_coeffs, res_beta=50, res_alpha=99
+    )
 
-    count = 0
+    # Bring the grid to the host once, instead of syncing once per radius.
+    position_probs = jax.device_get(position_probs)
+    per_radius_max = np.max(position_probs.grid_values, axis=(-2, -1))
     cmin = 0.0
-    cmax = position_probs.grid_values.max().item()
-    for i in range(len(radii)):
-        prob_r = position_probs[i]
-
-        # Skip if the probability is too small.
-        if prob_r.grid_values.max() < 1e-2 * cmax:
-            continue
-
-        count += 1
+    cmax = per_radius_max.max().item()
+
+    # Skip radii where the probability is too small.
+    # The meshes for all remaining radii are built together on the host.
+    kept_radii_indices = np.where(per_radius_max >= 1e-2 * cmax)[0]
+    unit_sphere = _get_unit_sphere_for_plotting(position_probs)
+    padded_probs = _pad_grid_values_for_plotting(
+        position_probs.grid_values[kept_radii_indices]
+    )
+    meshes = (
+        radii[kept_radii_indices, None, None, None] * unit_sphere
+        + np.asarray(focus_position)
+    )
+    for count, (mesh, prob_r) in enumerate(zip(meshes, padded_probs), start=1):
         surface_r = go.Surface(
-            **prob_r.plotly_surface(radius=radii[i], translation=focus_position),
+            x=mesh[:, :, 0],
+            y=mesh[:, :, 1],
+            z=mesh[:, :, 2],
+            surfacecolor=prob_r,
             colorscale=[[0, "rgba(4, 59, 192, 0.)"], [1, "rgba(4, 59, 192, 1.)"]],
             showscale=False,
             cmin=cmin,
@@ -318,19 +428,17 @@ def get_plotly_traces_for_predictions(
 
     # Plot spherical harmonic projections of logits.
     # Find closest index in RADII to the sampled positions.
-    radii = pred.globals.radial_bins
-    radius = np.linalg.norm(pred.globals.position_vectors, axis=-1)
-    most_likely_radius_index = np.abs(radii - radius).argmin()
+    # This is a tiny computation, so we do it on the host.
+    radius = np.linalg.norm(position_vectors, axis=-1)
+    most_likely_radius_index = int(np.abs(radii - radius).argmin())
     most_likely_radius = radii[most_likely_radius_index]
-    all_sigs = e3nn.to_s2grid(
-        position_coeffs, 50, 99, quadrature="soft", p_val=1, p_arg=-1
-    )
+    all_sigs = _coeffs_to_signal(position_coeffs, res_beta=50, res_alpha=99)
     cmin = all_sigs.grid_values.min().item()
     cmax = all_sigs.grid_values.max().item()
     for channel in range(position_coeffs.shape[0]):
         most_likely_radius_coeffs = position_coeffs[channel, most_likely_radius_index]
-        most_likely_radius_sig = e3nn.to_s2grid(
-            most_likely_radius_coeffs, 50, 99, quadrature="soft", p_val=1, p_arg=-1
+        most_likely_radius_sig = _coeffs_to_signal(
+            most_likely_radius_coeffs, res_beta=50, res_alpha=99
         )
         spherical_harmonics = go.Surface(
             most_likely_radius_sig.plotly_surface(
@@ -348,8 +456,6 @@ def get_plotly_traces_for_predictions(
         molecule_traces.append(spherical_harmonics)
 
     # Plot target species probabilities.
-    stop_probability = pred.globals.stop_probs.item()
-    predicted_target_species = pred.globals.target_species.item()
     if fragment.globals is not None and not fragment.globals.stop:
         true_focus = 0  # This is a convention used in our training pipeline.
         true_target_species = fragment.globals.target_species.item()
@@ -383,7 +489,7 @@ def get_plotly_traces_for_predictions(
                 for index, elem in enumerate(ELEMENTS[:num_elements])
             ],
             y=[get_focus_string(i) for i in range(num_nodes)],
-            z=np.round(pred.nodes.focus_and_target_species_probs, 3),
+            z=np.round(focus_and_target_species_probs, 3),
             texttemplate="%{z}",
             showlegend=False,
             showscale=False,
@@ -422,29 +528,16 @@ def visualize_fragment(
         fig.add_trace(trace, row=1, col=1)
 
     # Update the layout.
-    axis = dict(
-        showbackground=False,
-        showticklabels=False,
-        showgrid=False,
-        zeroline=False,
-        title="",
-        nticks=3,
-    )
     fig.update_layout(
         scene=dict(
-            xaxis=dict(**axis),
-            yaxis=dict(**axis, scaleanchor="x", scaleratio=1),
-            zaxis=dict(**axis, scaleanchor="x", scaleratio=1),
+            xaxis=_AXIS,
+            yaxis=dict(**_AXIS, scaleanchor="x", scaleratio=1),
+            zaxis=dict(**_AXIS, scaleanchor="x", scaleratio=1),
             aspectmode="data",
         ),
-        paper_bgcolor="rgba(255,255,255,1)",
-        plot_bgcolor="rgba(255,255,255,1)",
-        legend=dict(
-            yanchor="top",
-            y=0.99,
-            xanchor="right",
-            x=0.1,
-        ),
+        paper_bgcolor=_BACKGROUND_COLOR,
+        plot_bgcolor=_BACKGROUND_COLOR,
+        legend=_LEGEND,
     )
 
     try:
@@ -478,8 +571,12 @@ def visualize_predictions(
         stop_traces,
     ) = get_plotly_traces_for_predictions(pred, fragment)
 
+    # The atoms of the fragment are already drawn in the predictions panel
+    # by the focus probabilities trace.
     for trace in fragment_traces:
         fig.add_trace(trace, row=1, col=1)
+        if trace.name == _FRAGMENT_ATOMS_TRACE_NAME:
+            continue
         trace.showlegend = False
         fig.add_trace(trace, row=1, col=2)
 
@@ -508,40 +605,27 @@ def visualize_predictions(
     )
     min_range = centre_of_mass - furthest_dist
     max_range = centre_of_mass + furthest_dist
-    axis = dict(
-        showbackground=False,
-        showticklabels=False,
-        showgrid=False,
-        zeroline=False,
-        title="",
-        nticks=3,
-    )
     fig.update_layout(
         scene1=dict(
-            xaxis=dict(**axis, range=[min_range[0], max_range[0]]),
-            yaxis=dict(**axis, range=[min_range[1], max_range[1]]),
-            zaxis=dict(**axis, range=[min_range[2], max_range[2]]),
+            xaxis=dict(**_AXIS, range=[min_range[0], max_range[0]]),
+            yaxis=dict(**_AXIS, range=[min_range[1], max_range[1]]),
+            zaxis=dict(**_AXIS, range=[min_range[2], max_range[2]]),
             aspectmode="manual",
             aspectratio=dict(x=1, y=1, z=1),
         ),
         scene2=dict(
-            xaxis=dict(**axis, range=[min_range[0], max_range[0]]),
-            yaxis=dict(**axis, range=[min_range[1], max_range[1]]),
-            zaxis=dict(**axis, range=[min_range[2], max_range[2]]),
+            xaxis=dict(**_AXIS, range=[min_range[0], max_range[0]]),
+            yaxis=dict(**_AXIS, range=[min_range[1], max_range[1]]),
+            zaxis=dict(**_AXIS, range=[min_range[2], max_range[2]]),
             aspectmode="manual",
             aspectratio=dict(x=1, y=1, z=1),
         ),
         yaxis2=dict(
             range=[0, 1],
         ),
-        paper_bgcolor="rgba(255,255,255,1)",
-        plot_bgcolor="rgba(255,255,255,1)",
-        legend=dict(
-            yanchor="top",
-            y=0.99,
-            xanchor="right",
-            x=0.1,
-        ),
+        paper_bgcolor=_BACKGROUND_COLOR,
+        plot_bgcolor=_BACKGROUND_COLOR,
+        legend=_LEGEND,
     )
 
     # Sync cameras.
@@ -44,6 +44,8 @@ def get_config() -> ml_collections.ConfigDict:
     config.max_n_graphs = 32
     config.max_n_nodes = 15 * config.get_ref("max_n_graphs")
     config.max_n_edges = 45 * config.get_ref("max_n_graphs")
+    # Number of batches prepared ahead of training on a background thread.
+    config.num_prefetch_batches = 4
     config.loss_kwargs = ml_collections.ConfigDict()
     config.loss_kwargs.ignore_position_loss_for_small_fragments = False
     config.gradient_clip_norm = 1.0
@@ -41,6 +41,8 @@ def get_config() -> ml_collections.ConfigDict:
     config.max_n_graphs = 32
     config.max_n_nodes = 5 * config.get_ref("max_n_graphs")
     config.max_n_edges = 10 * config.get_ref("max_n_graphs")
+    # Number of batches prepared ahead of training on a background thread.
+    config.num_prefetch_batches = 4
     config.loss_kwargs = ml_collections.ConfigDict()
     config.loss_kwargs.radius_rbf_variance = 1e-3
     config.loss_kwargs.target_position_inverse_temperature = 20.0
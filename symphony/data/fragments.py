@@ -9,6 +9,18 @@ from symphony import datatypes
 from symphony.models import ptable
 
 
+@jax.jit
+def _choice(
+    rng: chex.PRNGKey, a: chex.Array, p: Optional[chex.Array] = None
+) -> chex.Array:
+    """Samples an element of a, with probabilities p if given.
+
+    Compiled once per shape, so each draw is a single dispatch
+    instead of one per operation inside jax.random.choice.
+    """
+    return jax.random.choice(rng, a, p=p)
+
+
 def generate_fragments(
     rng: chex.PRNGKey,
     graph: jraph.GraphsTuple,
@@ -101,10 +113,10 @@ def pick_targets(
 ):
     # Pick a random target species.
     rng, k = jax.random.split(rng)
-    target_species = jax.random.choice(
+    target_species = _choice(
         k,
-        len(target_species_probability_for_focus),
-        p=target_species_probability_for_focus,
+        np.arange(len(target_species_probability_for_focus)),
+        target_species_probability_for_focus,
     )
 
     # Pick up to max_targets_per_graph targets of the target species.
@@ -132,14 +144,14 @@ def _make_first_fragment(
         bound2 = ptable.groups[graph.nodes.species] <= 11
         transition_metals = (bound1 & bound2).astype(np.float32)
         transition_metals /= transition_metals.sum()
-        first_node = jax.random.choice(
-            k, np.arange(0, len(graph.nodes.positions)), p=transition_metals
+        first_node = _choice(
+            k, np.arange(0, len(graph.nodes.positions)), transition_metals
         )
     elif heavy_first and (graph.nodes.species != 0).sum() > 0:
         heavy_indices = np.argwhere(graph.nodes.species != 0).squeeze(-1)
-        first_node = jax.random.choice(k, heavy_indices)
+        first_node = _choice(k, heavy_indices)
     else:
-        first_node = jax.random.choice(k, np.arange(0, len(graph.nodes.positions)))
+        first_node = _choice(k, np.arange(0, len(graph.nodes.positions)))
     first_node = int(first_node)
 
     mask = graph.senders == first_node
@@ -181,7 +193,7 @@ def _make_first_fragment(
     )
 
     rng, k = jax.random.split(rng)
-    next_node = jax.random.choice(k, target_nodes)
+    next_node = _choice(k, target_nodes)
     visited = np.array([first_node, next_node])
     return rng, visited, sample
 
@@ -234,7 +246,7 @@ def _make_middle_fragment(
     # Pick a random focus node
     rng, k = jax.random.split(rng)
     focus_probability = _normalized_bitcount(senders[mask], n_nodes)
-    focus_node = jax.random.choice(k, n_nodes, p=focus_probability)
+    focus_node = _choice(k, np.arange(n_nodes), focus_probability)
     focus_node = int(focus_node)
 
     # Pick random targets
@@ -260,7 +272,7 @@ def _make_middle_fragment(
     )
 
     rng, k = jax.random.split(rng)
-    next_node = jax.random.choice(k, target_nodes)
+    next_node = _choice(k, target_nodes)
     visited = np.concatenate([visited, [next_node]])
     return rng, visited, sample
 
@@ -222,7 +222,8 @@ def _deprecated_get_unbatched_qm9_datasets(
     filenames = [os.path.join(root_dir, f) for f in filenames if "dataset_tf" in f]
 
     # Shuffle the filenames.
-    shuffled_indices = jax.random.permutation(rng, len(filenames))
+    # Move the permutation to the host once, rather than indexing per file.
+    shuffled_indices = np.asarray(jax.random.permutation(rng, len(filenames)))
     shuffled_filenames = [filenames[i] for i in shuffled_indices]
 
     # Partition the filenames into train, val, and test.
@@ -32,15 +32,28 @@ class Fragments(jraph.GraphsTuple):
     n_node: jnp.ndarray  # with integer dtype
     n_edge: jnp.ndarray  # with integer dtype
 
-    def from_graphstuple(graphs: jraph.GraphsTuple) -> "Fragments":
-        return Fragments(
-            nodes=graphs.nodes,
-            edges=graphs.edges,
-            receivers=graphs.receivers,
-            senders=graphs.senders,
-            globals=graphs.globals,
-            n_node=graphs.n_node,
-            n_edge=graphs.n_edge,
+    @classmethod
+    def from_graphstuple(cls, graphs: jraph.GraphsTuple) -> "Fragments":
+        """Views a GraphsTuple as Fragments."""
+        # Both share the same fields, so the arrays are reused as-is.
+        if isinstance(graphs, cls):
+            return graphs
+        return cls._make(graphs)
+
+    def as_graphstuple(self) -> jraph.GraphsTuple:
+        """Views these fragments as a plain GraphsTuple."""
+        return jraph.GraphsTuple(*self)
+
+    def pad_to(self, n_node: int, n_edge: int, n_graph: int) -> "Fragments":
+        """Pads to a fixed number of nodes, edges and graphs, so that jitted consumers see a single shape.
+
+        Padding follows jraph's convention: padded entries belong to padding graphs,
+        which can be masked out with jraph.get_node_padding_mask and jraph.get_graph_padding_mask.
+        At least one padding graph and node are added, so n_graph and n_node must exceed
+        the current number of graphs and nodes, while n_edge must be at least the current number of edges.
+        """
+        return self.from_graphstuple(
+            jraph.pad_with_graphs(self, n_node=n_node, n_edge=n_edge, n_graph=n_graph)
         )
 
 
@@ -12,6 +12,7 @@ import flax.struct
 from rdkit import Chem
 import wandb
 from clu import metric_writers, checkpoint
+import jax
 import jax.numpy as jnp
 
 
@@ -223,13 +224,15 @@ class CheckpointHook:
         state = flax.jax_utils.unreplicate(state)
 
         # Save the current and best params.
+        # These are saved as NumPy arrays, so that loading them does not allocate on device.
+        params, best_params = jax.device_get((state.params, state.best_params))
         with open(
             os.path.join(self.checkpoint_dir, f"params_{state.get_step()}.pkl"), "wb"
         ) as f:
-            pickle.dump(state.params, f)
+            pickle.dump(params, f, protocol=5)
 
         with open(os.path.join(self.checkpoint_dir, "params_best.pkl"), "wb") as f:
-            pickle.dump(state.best_params, f)
+            pickle.dump(best_params, f, protocol=5)
 
         # Save the whole training state.
         self.ckpt.save(
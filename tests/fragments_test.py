@@ -1,23 +1,31 @@
 """Tests for fragment generation."""
 
-from typing import Tuple
-import tempfile
+import functools
 
 from absl.testing import absltest
 from absl.testing import parameterized
 import ase
+import ase.build
 import jax
 import jax.profiler
-from jax import numpy as jnp
+import jraph
 import logging
-import os
+import numpy as np
 
+from symphony import datatypes
 from symphony.data import fragments, input_pipeline
 
 # Important to see the logging messages!
 logging.getLogger().setLevel(logging.INFO)
 
 
+@functools.lru_cache(maxsize=1)
+def _load_mol_graph() -> jraph.GraphsTuple:
+    """Builds the graph of propane (C3H8), once per test process."""
+    mol = ase.build.molecule("C3H8")
+    return input_pipeline.ase_atoms_to_jraph_graph(mol, [1, 6, 7, 8, 9], 2.0)
+
+
 class FragmentTest(parameterized.TestCase):
     def setUp(self):
         super().setUp()
@@ -25,50 +33,68 @@ class FragmentTest(parameterized.TestCase):
     @parameterized.product(
         mode=["nn", "radius"],
         heavy_first=[True, False],
-        beta_com=[0.0, 100.0],
     )
     def test_fragment_generation_heavy_first(
         self,
         mode: str,
         heavy_first: bool,
-        beta_com: float,
         seed: int = 0,
-        eps: float = 1e-5,
     ):
-        """Tests that training and evaluation runs without errors."""
-        dirname = os.path.dirname(__file__)
-        mol_file = os.path.join(dirname, "C3H8.xyz")
-        mol = ase.io.read(mol_file)
-        mol_graph = input_pipeline.ase_atoms_to_jraph_graph(mol, [1, 6, 7, 8, 9], 2.0)
-        num_heavy_atoms = (mol_graph.nodes.species > 0).sum()
-        com = jnp.average(
-            mol_graph.nodes.positions,
-            axis=0,
-            weights=(mol_graph.nodes.species > 0) if heavy_first else None,
-        )
-        distances_com = jnp.linalg.norm(mol_graph.nodes.positions - com, axis=1)
+        """Tests that heavy atoms are added to fragments before hydrogens, if heavy_first is set."""
+        mol_graph = _load_mol_graph()
+        num_heavy_atoms = (np.asarray(mol_graph.nodes.species) > 0).sum()
         for frag in fragments.generate_fragments(
             jax.random.PRNGKey(seed),
             mol_graph,
-            5,
-            heavy_first=heavy_first,
-            beta_com=beta_com,
+            num_species=5,
+            nn_tolerance=0.1 if mode == "nn" else None,
+            max_radius=2.0 if mode == "radius" else None,
             mode=mode,
+            heavy_first=heavy_first,
+            max_targets_per_graph=4,
+            transition_first=False,
         ):
-            num_atoms = frag.nodes.species.shape[0]
+            species = np.asarray(frag.nodes.species)
+            num_atoms = species.shape[0]
             if heavy_first and num_atoms <= num_heavy_atoms:
-                assert jnp.all(
-                    frag.nodes.species > 0
+                assert np.all(
+                    species > 0
                 ), "hydrogen atom was added to fragment before all heavy atoms were added"
-            if beta_com > 0 and num_atoms == 1:
-                # This is assuming that beta_com is large enough that the first atom is always the closest to the center of mass
-                assert (
-                    jnp.abs(
-                        distances_com.min()
-                        - jnp.linalg.norm(frag.nodes.positions[0] - com)
-                    )
-                    < eps
-                ), "first atom in fragment is not closest to center of mass"
+
+    def test_pad_to(self):
+        """Tests that padded fragments have the requested shapes, with the padding masked out."""
+        mol_graph = _load_mol_graph()
+        frag = list(
+            fragments.generate_fragments(
+                jax.random.PRNGKey(0),
+                mol_graph,
+                num_species=5,
+                nn_tolerance=0.1,
+                max_radius=None,
+                mode="nn",
+                heavy_first=False,
+                max_targets_per_graph=4,
+                transition_first=False,
+            )
+        )[-1]
+        frag = datatypes.Fragments.from_graphstuple(frag)
+        num_nodes = frag.nodes.species.shape[0]
+
+        padded_frag = frag.pad_to(n_node=32, n_edge=256, n_graph=2)
+        self.assertIsInstance(padded_frag, datatypes.Fragments)
+        self.assertEqual(padded_frag.nodes.positions.shape, (32, 3))
+        self.assertEqual(padded_frag.nodes.species.shape, (32,))
+        self.assertEqual(padded_frag.senders.shape, (256,))
+        self.assertEqual(padded_frag.receivers.shape, (256,))
+        self.assertEqual(padded_frag.n_node.shape, (2,))
+        self.assertEqual(padded_frag.globals.target_positions.shape[0], 2)
+        np.testing.assert_array_equal(
+            np.asarray(jraph.get_node_padding_mask(padded_frag)),
+            np.arange(32) < num_nodes,
+        )
+        np.testing.assert_array_equal(
+            np.asarray(jraph.get_graph_padding_mask(padded_frag)), [True, False]
+        )
 
 
 if __name__ == "__main__":
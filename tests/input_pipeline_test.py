@@ -1,3 +1,54 @@
 """Tests for the input pipeline."""
 
-# TODO: ameyad
+from absl.testing import absltest
+
+from symphony.data import input_pipeline
+
+
+class PrefetchInBackgroundTest(absltest.TestCase):
+    def test_yields_items_in_order(self):
+        """Tests that all items are yielded, in order."""
+        prefetched = input_pipeline.prefetch_in_background(
+            iter(range(100)), buffer_size=4
+        )
+        self.assertEqual(list(prefetched), list(range(100)))
+
+    def test_ends_cleanly(self):
+        """Tests that the iterator stops once the underlying iterator is exhausted."""
+        prefetched = input_pipeline.prefetch_in_background(iter([1, 2]), buffer_size=4)
+        self.assertEqual(next(prefetched), 1)
+        self.assertEqual(next(prefetched), 2)
+        with self.assertRaises(StopIteration):
+            next(prefetched)
+
+    def test_reraises_producer_errors(self):
+        """Tests that errors raised while producing items are re-raised in the consumer."""
+
+        def failing_iterator():
+            yield 0
+            raise ValueError("Failed to produce item.")
+
+        prefetched = input_pipeline.prefetch_in_background(
+            failing_iterator(), buffer_size=4
+        )
+        self.assertEqual(next(prefetched), 0)
+        with self.assertRaisesRegex(ValueError, "Failed to produce item."):
+            next(prefetched)
+
+    def test_does_not_hang_if_producer_exits(self):
+        """Tests that the consumer is unblocked even if the producer raises a BaseException."""
+
+        def exiting_iterator():
+            yield 0
+            raise SystemExit
+
+        prefetched = input_pipeline.prefetch_in_background(
+            exiting_iterator(), buffer_size=4
+        )
+        self.assertEqual(next(prefetched), 0)
+        with self.assertRaises(SystemExit):
+            next(prefetched)
+
+
+if __name__ == "__main__":
+    absltest.main()